@@ -1,7 +1,11 @@
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
+import os
+import time
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from contextlib import asynccontextmanager
 
 
@@ -10,25 +14,76 @@ logger = logging.getLogger(__name__)
 
 models = {}
 
+# On-demand profiling is off unless explicitly enabled for the pod
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_MAX_DURATION = float(os.getenv("PROFILING_MAX_DURATION", "60"))
+profiling = {"session": None}
+
+# 0 serves in-process; N > 0 shards requests over N worker processes
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "5"))
+INFERENCE_MAX_RESTARTS = int(os.getenv("INFERENCE_MAX_RESTARTS", "5"))
+INFERENCE_MAX_IN_FLIGHT = int(os.getenv("INFERENCE_MAX_IN_FLIGHT", "256"))
+INFERENCE_STALL_TIMEOUT = float(os.getenv("INFERENCE_STALL_TIMEOUT", "30"))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Loading ML models...")
     try:
-        from models.stage1_candidate import CandidateGenerator
-        from models.stage2_rerank import Stage2ReRanker
-        
-        models["candidate_gen"] = CandidateGenerator()
-        models["reranker"] = Stage2ReRanker()
-        logger.info("Models loaded successfully.")
+        from utils.candidate_filters import load_genre_bits
+
+        models["genre_bits"] = load_genre_bits()
+        if INFERENCE_WORKERS > 0:
+            from models.stage1_candidate import export_als_factors
+            from utils.inference_pool import InferencePool
+
+            export_als_factors()
+            pool = InferencePool(
+                INFERENCE_WORKERS,
+                timeout=INFERENCE_TIMEOUT,
+                max_in_flight=INFERENCE_MAX_IN_FLIGHT,
+                stall_timeout=INFERENCE_STALL_TIMEOUT,
+                max_restarts=INFERENCE_MAX_RESTARTS
+            )
+            pool.start()
+            try:
+                await asyncio.to_thread(pool.wait_ready)
+            except Exception:
+                pool.shutdown()
+                raise
+            models["pool"] = pool
+            logger.info(f"Inference pool started with {INFERENCE_WORKERS} workers.")
+        else:
+            from models.stage1_candidate import CandidateGenerator
+            from models.stage2_rerank import Stage2ReRanker
+
+            models["candidate_gen"] = CandidateGenerator()
+            models["reranker"] = Stage2ReRanker()
+            logger.info("Models loaded successfully.")
     except Exception as e:
         logger.error(f"Failed to load models: {e}")
         raise e
     yield
+    if "pool" in models:
+        models["pool"].shutdown()
     models.clear()
 
 app = FastAPI(lifespan=lifespan)
 
 
+async def count_profiled_requests(request: Request, call_next):
+    response = await call_next(request)
+    session = profiling["session"]
+    if session is not None and request.url.path == "/recommend":
+        session.record_request()
+    return response
+
+
+# Only pay for the middleware when the profiling endpoint is usable
+if PROFILING_ENABLED:
+    app.middleware("http")(count_profiled_requests)
+
+
 class RecommendationResponse(BaseModel):
     user_id: int
     recommendations: List[int]
@@ -40,15 +95,63 @@ def health_check():
     return {"status": "Ranking Service is Online", "models_loaded": len(models) > 0}
 
 
+@app.get("/health/workers", tags=["Health"])
+async def workers_health():
+    if "pool" not in models:
+        return {"mode": "in-process", "workers": []}
+
+    workers = models["pool"].health()
+    status = "ok" if all(w["responsive"] for w in workers) else "degraded"
+    return {"mode": "pool", "status": status, "workers": workers}
+
+
 @app.get("/recommend", response_model=RecommendationResponse)
-async def recommend(user_id: int, top_k: int = 10):
+async def recommend(
+    user_id: int,
+    top_k: int = 10,
+    genres: Optional[List[str]] = Query(None),
+    exclude_seen: bool = True,
+    exclude_unavailable: bool = True
+):
     if user_id < 0:
         raise HTTPException(status_code=400, detail="Invalid User ID")
+    if genres:
+        from utils.candidate_filters import UnknownGenreError, genre_mask
+
+        try:
+            genre_mask(models["genre_bits"], genres)
+        except UnknownGenreError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        # 2. Stage 1: Candidate Generation (Retrieval)
+        if "pool" in models:
+            from utils.inference_pool import WorkerOverloadedError
+
+            # Both stages run inside the worker that owns this user
+            try:
+                final_items = await models["pool"].recommend(
+                    user_id,
+                    top_k=top_k,
+                    genres=genres,
+                    filter_already_liked_items=exclude_seen,
+                    filter_unavailable=exclude_unavailable
+                )
+            except WorkerOverloadedError as e:
+                logger.warning(f"Shedding request for user {user_id}: {e}")
+                raise HTTPException(status_code=503, detail="Ranking Service Overloaded")
+            if not final_items:
+                return RecommendationResponse(user_id=user_id, recommendations=[], status="no_candidates")
+            return RecommendationResponse(user_id=user_id, recommendations=final_items)
+
+        # 2. Stage 1: Candidate Generation (Retrieval) with eligibility filters
         logger.info(f"Generating candidates for user {user_id}")
-        candidates, scores = models["candidate_gen"].recommend_with_scores(user_id, top_n=top_k * 5)
+        candidates, scores = models["candidate_gen"].recommend_with_scores(
+            user_id,
+            top_n=top_k * 5,
+            genres=genres,
+            filter_already_liked_items=exclude_seen,
+            filter_unavailable=exclude_unavailable
+        )
         
         if not candidates:
             return RecommendationResponse(user_id=user_id, recommendations=[], status="no_candidates")
@@ -62,6 +165,71 @@ async def recommend(user_id: int, top_k: int = 10):
             recommendations=final_items
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during recommendation: {e}")
-        raise HTTPException(status_code=500, detail="Internal Ranking Error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal Ranking Error")
+
+
+@app.get("/debug/profile", tags=["Debug"])
+async def profile(
+    duration: float = 10.0,
+    requests: Optional[int] = None,
+    interval_ms: float = 5.0,
+    memory: bool = False,
+    top: int = 20,
+    format: str = "json"
+):
+    """
+    Sample the live process until `duration` seconds pass or `requests`
+    /recommend calls complete, then return aggregated stacks. In pool
+    mode every worker is profiled too and the results are merged.
+    """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not 0 < duration <= PROFILING_MAX_DURATION:
+        raise HTTPException(status_code=400, detail=f"duration must be in (0, {PROFILING_MAX_DURATION}]")
+    if interval_ms < 1.0:
+        raise HTTPException(status_code=400, detail="interval_ms must be >= 1")
+    if format not in ("json", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'collapsed'")
+    if profiling["session"] is not None:
+        raise HTTPException(status_code=409, detail="Profiling already in progress")
+
+    from utils.profiling import ProfileSession, merge_reports
+
+    pool = models.get("pool")
+    session = ProfileSession(
+        duration=duration,
+        max_requests=requests,
+        interval=interval_ms / 1000.0,
+        memory=memory
+    )
+    profiling["session"] = session
+    logger.info(f"Profiling started: duration={duration}s requests={requests} memory={memory}")
+    worker_exports = {}
+    try:
+        session.start()
+        if pool is not None:
+            await pool.start_profile(interval=interval_ms / 1000.0, memory=memory)
+        deadline = time.perf_counter() + duration
+        while not session.done.is_set() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        if pool is not None:
+            worker_exports = await pool.stop_profile(top=top)
+        session.stop()
+        profiling["session"] = None
+
+    if pool is None:
+        report = session.report(top=top)
+    else:
+        report = merge_reports(
+            {"parent": session.export(top=top), **worker_exports},
+            requests=session.requests,
+            top=top
+        )
+    if format == "collapsed":
+        return PlainTextResponse(report["collapsed"])
+    return report
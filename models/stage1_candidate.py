@@ -1,13 +1,63 @@
+import os
 import pickle
+import tempfile
 import numpy as np
 from scipy.sparse import load_npz
 from implicit.als import AlternatingLeastSquares
+from utils.candidate_filters import ItemFilterIndex
+
+
+def _atomic_save(path, array):
+    # A crash mid-write must never leave a truncated file at `path`
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npy.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def export_als_factors(artifacts_path="models/artifacts"):
+    """
+    Dump ALS factors as plain .npy files so worker processes can
+    memory-map one shared copy instead of unpickling their own.
+    """
+    model_path = f"{artifacts_path}/als_model.pkl"
+    user_path = f"{artifacts_path}/als_user_factors.npy"
+    item_path = f"{artifacts_path}/als_item_factors.npy"
+    if (
+        os.path.exists(user_path)
+        and os.path.exists(item_path)
+        and os.path.getmtime(user_path) >= os.path.getmtime(model_path)
+        and os.path.getmtime(item_path) >= os.path.getmtime(model_path)
+    ):
+        return
+
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    _atomic_save(user_path, np.ascontiguousarray(model.user_factors))
+    _atomic_save(item_path, np.ascontiguousarray(model.item_factors))
+
 
 class CandidateGenerator:
-    def __init__(self, artifacts_path="models/artifacts"):
-        self.model = AlternatingLeastSquares()
-        with open(f"{artifacts_path}/als_model.pkl", "rb") as f:
-            self.model = pickle.load(f)
+    def __init__(self, artifacts_path="models/artifacts", data_path="data", mmap_factors=False):
+        user_path = f"{artifacts_path}/als_user_factors.npy"
+        item_path = f"{artifacts_path}/als_item_factors.npy"
+        if mmap_factors and os.path.exists(user_path) and os.path.exists(item_path):
+            # Read-only pages are shared through the OS page cache
+            self.model = None
+            self.user_factors = np.load(user_path, mmap_mode="r")
+            self.item_factors = np.load(item_path, mmap_mode="r")
+        else:
+            self.model = AlternatingLeastSquares()
+            with open(f"{artifacts_path}/als_model.pkl", "rb") as f:
+                self.model = pickle.load(f)
+            self.user_factors = self.model.user_factors
+            self.item_factors = self.model.item_factors
 
         self.matrix = load_npz(f"{artifacts_path}/interaction_matrix.npz")
 
@@ -21,26 +71,57 @@ class CandidateGenerator:
 
         self.user_id_to_internal = {k: v for k, v in self.user_map.items()}
 
-    def recommend_with_scores(self, user_id: int, top_n=100):
+        self.filters = ItemFilterIndex(
+            self.item_map,
+            self.matrix,
+            data_path=data_path,
+            artifacts_path=artifacts_path
+        )
+
+    def recommend_with_scores(
+        self,
+        user_id: int,
+        top_n=100,
+        genres=None,
+        filter_already_liked_items=True,
+        filter_unavailable=True
+    ):
+        """
+        Score all items with ALS, mask out ineligible ones and select top-N,
+        so filtered items never take a candidate slot.
+        """
+        # Reject unknown genres even for users we cannot score
+        if genres:
+            self.filters.genre_mask(genres)
+
         if user_id not in self.user_id_to_internal:
             return [], []
 
         uid = self.user_id_to_internal[user_id]
-        user_row = self.matrix[uid]
-
-        items, scores = self.model.recommend(
-            userid=uid,
-            user_items=user_row,
-            N=top_n,
-            filter_already_liked_items=True
+        eligible = self.filters.eligible(
+            uid,
+            genres=genres,
+            exclude_seen=filter_already_liked_items,
+            exclude_unavailable=filter_unavailable
         )
 
+        n_eligible = int(eligible.sum())
+        top_n = min(top_n, n_eligible)
+        if top_n <= 0:
+            return [], []
+
+        scores = self.item_factors @ self.user_factors[uid]
+        scores = np.where(eligible, scores, -np.inf)
+
+        items = np.argpartition(-scores, top_n - 1)[:top_n]
+        items = items[np.argsort(-scores[items])]
+
         item_ids = [self.internal_to_item_id[i] for i in items]
-        return item_ids, scores.tolist()
+        return item_ids, scores[items].tolist()
 
 
-    def recommend(self, user_id: int, top_n=100):
-        return self.recommend_with_scores(user_id, top_n)[0]
+    def recommend(self, user_id: int, top_n=100, **filters):
+        return self.recommend_with_scores(user_id, top_n, **filters)[0]
     
     def predict(self, user_id: int, item_id: int):
         if user_id not in self.user_id_to_internal or item_id not in self.item_map:
@@ -49,5 +130,5 @@ class CandidateGenerator:
         uid = self.user_id_to_internal[user_id]
         iid = self.item_map[item_id]
 
-        score = np.dot(self.model.user_factors[uid], self.model.item_factors[iid])
+        score = np.dot(self.user_factors[uid], self.item_factors[iid])
         return score
\ No newline at end of file
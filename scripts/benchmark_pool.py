@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from models.stage1_candidate import export_als_factors
+from utils.inference_pool import InferencePool
+
+
+async def run_load(pool, user_ids, concurrency, top_k):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(user_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await pool.recommend(int(user_id), top_k=top_k)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(u) for u in user_ids))
+    return time.perf_counter() - started, np.array(latencies)
+
+
+def benchmark(n_workers, user_ids, concurrency, top_k):
+    pool = InferencePool(n_workers, timeout=60.0)
+    pool.start()
+    try:
+        pool.wait_ready()
+        # warm up every worker before timing
+        asyncio.run(run_load(pool, user_ids[:n_workers * 20], concurrency, top_k))
+        elapsed, latencies = asyncio.run(run_load(pool, user_ids, concurrency, top_k))
+    finally:
+        pool.shutdown()
+    return len(user_ids) / elapsed, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of the sharded inference pool vs. worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    worker_counts = args.workers or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    cols = ["user_id", "item_id", "rating", "timestamp"]
+    test_df = pd.read_csv("data/ua.test", sep="\t", names=cols)
+    rng = np.random.default_rng(0)
+    user_ids = rng.choice(test_df["user_id"].unique(), size=args.requests)
+
+    export_als_factors()
+
+    baseline = None
+    print(f"{'workers':>7} | {'req/s':>8} | {'speedup':>7} | {'p50 ms':>7} | {'p99 ms':>7}")
+    for n_workers in worker_counts:
+        throughput, latencies = benchmark(n_workers, user_ids, args.concurrency, args.top_k)
+        baseline = baseline or throughput
+        p50, p99 = np.percentile(latencies * 1000, [50, 99])
+        print(f"{n_workers:>7} | {throughput:>8.1f} | {throughput / baseline:>6.2f}x | {p50:>7.1f} | {p99:>7.1f}")
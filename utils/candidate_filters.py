@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+class UnknownGenreError(ValueError):
+    pass
+
+
+def load_genre_bits(data_path="data") -> dict:
+    genres = pd.read_csv(
+        f"{data_path}/u.genre",
+        sep="|",
+        names=["genre", "id"],
+        encoding="ISO-8859-1",
+    ).dropna()
+    return {
+        name.lower(): np.uint32(1 << int(gid))
+        for name, gid in zip(genres.genre, genres.id)
+    }
+
+
+def genre_mask(genre_to_bit, genres) -> np.uint32:
+    mask = np.uint32(0)
+    for genre in genres:
+        bit = genre_to_bit.get(genre.lower())
+        if bit is None:
+            raise UnknownGenreError(f"Unknown genre: {genre}")
+        mask |= bit
+    return mask
+
+
+class ItemFilterIndex:
+    """
+    Precomputed per-item bitmasks used to restrict Stage 1 retrieval.
+
+    All arrays are indexed by the ALS internal item index, so an eligibility
+    mask can be applied directly to the full score vector before top-K.
+    """
+
+    def __init__(self, item_map, matrix, data_path="data", artifacts_path="models/artifacts"):
+        self.n_items = matrix.shape[1]
+
+        # Seen items come straight from the CSR interaction matrix: the
+        # column indices of row `uid` are that user's seen set.
+        self.seen_indptr = matrix.indptr
+        self.seen_indices = matrix.indices
+
+        self.genre_to_bit = load_genre_bits(data_path)
+
+        items = pd.read_csv(f"{data_path}/u.item", sep="|", header=None, encoding="ISO-8859-1")
+        item_ids = items[0].to_numpy()
+        flags = items.iloc[:, 5:5 + len(self.genre_to_bit)].to_numpy(dtype=np.uint32)
+        bits = (flags << np.arange(flags.shape[1], dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+
+        self.genre_bits = np.zeros(self.n_items, dtype=np.uint32)
+        for item_id, item_bits in zip(item_ids, bits):
+            iid = item_map.get(item_id)
+            if iid is not None:
+                self.genre_bits[iid] = item_bits
+
+        # Optional list of external item ids that must never be served
+        self.available = np.ones(self.n_items, dtype=bool)
+        unavailable_path = f"{artifacts_path}/unavailable_items.npy"
+        if os.path.exists(unavailable_path):
+            self.set_availability(np.load(unavailable_path), item_map, available=False)
+
+    def set_availability(self, item_ids, item_map, available: bool):
+        internal = [item_map[i] for i in item_ids if i in item_map]
+        self.available[internal] = available
+
+    def genre_mask(self, genres) -> np.uint32:
+        return genre_mask(self.genre_to_bit, genres)
+
+    def eligible(self, uid: int, genres=None, exclude_seen=True, exclude_unavailable=True) -> np.ndarray:
+        """
+        Boolean mask over internal item indices; an item matches a genre
+        filter if it has any of the requested genres.
+        """
+        if exclude_unavailable:
+            mask = self.available.copy()
+        else:
+            mask = np.ones(self.n_items, dtype=bool)
+
+        if genres:
+            mask &= (self.genre_bits & self.genre_mask(genres)) != 0
+
+        if exclude_seen:
+            mask[self.seen_indices[self.seen_indptr[uid]:self.seen_indptr[uid + 1]]] = False
+
+        return mask
@@ -0,0 +1,433 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from utils.candidate_filters import UnknownGenreError
+
+
+logger = logging.getLogger(__name__)
+
+# Replies are raw bytes: (request id, status) header followed by an int32
+# item array for recommendations, JSON for profiles, or a utf-8 error
+# message otherwise.
+_HEADER = struct.Struct("<QB")
+STATUS_OK, STATUS_BAD_REQUEST, STATUS_ERROR = 0, 1, 2
+READY_ID = 0
+
+
+class WorkerOverloadedError(RuntimeError):
+    pass
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class ConsistentHashRing:
+    """
+    Maps keys to nodes with virtual replicas, so changing the worker count
+    only remaps ~1/N of users and per-worker caches stay warm.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self._ring = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    def get(self, key):
+        idx = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._ring[idx][1]
+
+
+def _worker_main(conn, artifacts_path):
+    logging.basicConfig(level=logging.INFO)
+    from models.stage1_candidate import CandidateGenerator
+    from models.stage2_rerank import Stage2ReRanker
+    from utils.profiling import ProfileSession
+
+    candidate_gen = CandidateGenerator(artifacts_path=artifacts_path, mmap_factors=True)
+    reranker = Stage2ReRanker(artifacts_path=artifacts_path)
+    conn.send_bytes(_HEADER.pack(READY_ID, STATUS_OK))
+
+    session = None
+    while True:
+        try:
+            req_id, kind, params = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        if kind == "profile_start":
+            if session is not None:
+                session.stop()
+            session = ProfileSession(duration=None, **params)
+            session.start()
+            conn.send_bytes(_HEADER.pack(req_id, STATUS_OK))
+            continue
+
+        if kind == "profile_stop":
+            if session is None:
+                conn.send_bytes(_HEADER.pack(req_id, STATUS_ERROR) + b"Worker is not profiling")
+                continue
+            session.stop()
+            payload = json.dumps(session.export(top=params["top"])).encode()
+            session = None
+            conn.send_bytes(_HEADER.pack(req_id, STATUS_OK) + payload)
+            continue
+
+        try:
+            top_k = params.pop("top_k")
+            candidates, scores = candidate_gen.recommend_with_scores(top_n=top_k * 5, **params)
+            items = (
+                reranker.rerank(params["user_id"], candidates, top_k=top_k, als_scores=scores)
+                if candidates else []
+            )
+            payload = np.asarray(items, dtype=np.int32).tobytes()
+            conn.send_bytes(_HEADER.pack(req_id, STATUS_OK) + payload)
+        except UnknownGenreError as e:
+            conn.send_bytes(_HEADER.pack(req_id, STATUS_BAD_REQUEST) + str(e).encode())
+        except Exception as e:
+            logger.error(f"Worker error during recommendation: {e}")
+            conn.send_bytes(_HEADER.pack(req_id, STATUS_ERROR) + str(e).encode())
+
+
+def _decode_items(payload):
+    return np.frombuffer(payload, dtype=np.int32).tolist()
+
+
+def _decode_json(payload):
+    return json.loads(bytes(payload))
+
+
+def _settle(future, decode, status, payload):
+    if future.done():
+        return
+    if status == STATUS_OK:
+        future.set_result(decode(payload) if decode is not None else None)
+    elif status == STATUS_BAD_REQUEST:
+        future.set_exception(UnknownGenreError(bytes(payload).decode()))
+    else:
+        future.set_exception(RuntimeError(bytes(payload).decode()))
+
+
+class _Worker:
+    """
+    Parent-side handle of one worker process.
+
+    Requests go through a queue to a dedicated writer thread, so a slow or
+    hung worker can only block that thread, never the event loop or the
+    monitor. Progress is judged by replies: `outstanding` counts requests
+    handed to the worker and not yet answered, including ones whose
+    callers already timed out.
+    """
+
+    def __init__(self, index, ctx, artifacts_path):
+        self.index = index
+        self.ctx = ctx
+        self.artifacts_path = artifacts_path
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.outstanding = 0
+        self.last_progress = time.monotonic()
+        self.restarts = 0
+        self.failures = 0
+        self.next_restart_at = 0.0
+        self.gave_up = False
+        self.ready = False
+        self.process = None
+        self.conn = None
+        self.outbox = None
+
+    def start(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.artifacts_path),
+            name=f"inference-worker-{self.index}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+
+        outbox = queue.SimpleQueue()
+        with self.lock:
+            self.ready = False
+            self.outstanding = 0
+            self.last_progress = time.monotonic()
+            self.process = process
+            self.conn = parent_conn
+            self.outbox = outbox
+        threading.Thread(target=self._read, args=(parent_conn,), daemon=True).start()
+        threading.Thread(target=self._write, args=(parent_conn, outbox), daemon=True).start()
+
+    def _read(self, conn):
+        while True:
+            try:
+                data = conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+
+            req_id, status = _HEADER.unpack_from(data)
+            with self.lock:
+                if conn is not self.conn:
+                    # Late message from a connection that was already failed
+                    break
+                if req_id == READY_ID:
+                    self.ready = True
+                    self.failures = 0
+                    continue
+                self.outstanding -= 1
+                self.last_progress = time.monotonic()
+                deliver = self.pending.pop(req_id, None)
+            if deliver is not None:
+                deliver(status, memoryview(data)[_HEADER.size:])
+
+    def _write(self, conn, outbox):
+        while True:
+            message = outbox.get()
+            if message is None:
+                break
+            try:
+                conn.send(message)
+            except (OSError, ValueError):
+                with self.lock:
+                    deliver = self.pending.pop(message[0], None)
+                if deliver is not None:
+                    deliver(STATUS_ERROR, f"Inference worker {self.index} unavailable".encode())
+
+    def submit(self, req_id, kind, params, deliver, max_in_flight=None):
+        with self.lock:
+            if self.conn.closed:
+                raise RuntimeError(f"Inference worker {self.index} unavailable")
+            if max_in_flight is not None and self.outstanding >= max_in_flight:
+                raise WorkerOverloadedError(f"Inference worker {self.index} is overloaded")
+            if self.outstanding == 0:
+                self.last_progress = time.monotonic()
+            self.outstanding += 1
+            self.pending[req_id] = deliver
+            self.outbox.put((req_id, kind, params))
+
+    def discard(self, req_id):
+        with self.lock:
+            self.pending.pop(req_id, None)
+
+    def stalled_for(self) -> float:
+        with self.lock:
+            if self.outstanding == 0:
+                return 0.0
+            return time.monotonic() - self.last_progress
+
+    def fail(self, reason):
+        """
+        Close the pipe and fail in-flight requests; new submits raise
+        immediately instead of waiting for the request timeout.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.conn.close()
+            self.outbox.put(None)
+            self.ready = False
+        message = f"Inference worker {self.index} {reason}".encode()
+        for deliver in pending.values():
+            deliver(STATUS_ERROR, message)
+
+    def stop(self):
+        with self.lock:
+            self.conn.close()
+            self.outbox.put(None)
+        self.process.terminate()
+        self.process.join(timeout=5)
+
+
+class InferencePool:
+    """
+    N spawned worker processes, each running the full two-stage pipeline.
+
+    Requests are routed by a consistent hash of user_id, so the same user
+    always lands on the same worker. A monitor thread kills workers that
+    stop answering outstanding requests, and restarts dead workers with
+    exponential backoff until `max_restarts` consecutive failures.
+    """
+
+    def __init__(
+        self,
+        n_workers,
+        artifacts_path="models/artifacts",
+        timeout=5.0,
+        max_in_flight=256,
+        stall_timeout=30.0,
+        health_interval=1.0,
+        max_restarts=5,
+        backoff_base=1.0,
+        backoff_max=60.0
+    ):
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.stall_timeout = stall_timeout
+        self.health_interval = health_interval
+        self.max_restarts = max_restarts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        ctx = mp.get_context("spawn")
+        self.workers = [_Worker(i, ctx, artifacts_path) for i in range(n_workers)]
+        self.ring = ConsistentHashRing(range(n_workers))
+        self._ids = itertools.count(READY_ID + 1)
+        self._stop = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self._stop.clear()
+        self._monitor = threading.Thread(target=self._watch, name="inference-pool-monitor", daemon=True)
+        self._monitor.start()
+
+    def wait_ready(self, timeout=120.0):
+        deadline = time.monotonic() + timeout
+        while not all(worker.ready for worker in self.workers):
+            if any(worker.gave_up for worker in self.workers):
+                raise RuntimeError("Inference workers failed to start")
+            if time.monotonic() > deadline:
+                raise TimeoutError("Inference workers did not become ready in time")
+            time.sleep(0.1)
+
+    def _watch(self):
+        while not self._stop.wait(self.health_interval):
+            self._check_liveness()
+            self._check_progress()
+
+    def _check_liveness(self):
+        for worker in self.workers:
+            if worker.gave_up or worker.process.is_alive():
+                continue
+
+            now = time.monotonic()
+            if not worker.conn.closed:
+                logger.error(
+                    f"Inference worker {worker.index} (pid {worker.process.pid}) exited "
+                    f"with code {worker.process.exitcode}"
+                )
+                worker.fail("crashed")
+                worker.failures += 1
+                if worker.failures > self.max_restarts:
+                    worker.gave_up = True
+                    logger.error(
+                        f"Inference worker {worker.index} failed {worker.failures} times in a row, "
+                        f"not restarting"
+                    )
+                    continue
+                delay = min(self.backoff_base * 2 ** (worker.failures - 1), self.backoff_max)
+                worker.next_restart_at = now + delay
+                logger.info(f"Restarting inference worker {worker.index} in {delay:.1f}s")
+
+            if now >= worker.next_restart_at:
+                worker.process.join(timeout=1)
+                worker.restarts += 1
+                worker.start()
+
+    def _check_progress(self):
+        # A deep but moving queue is healthy; only a worker that has
+        # answered nothing for `stall_timeout` while owing replies is hung.
+        for worker in self.workers:
+            if not worker.ready or not worker.process.is_alive():
+                continue
+            stalled = worker.stalled_for()
+            if stalled >= self.stall_timeout:
+                logger.error(
+                    f"Inference worker {worker.index} (pid {worker.process.pid}) made no progress "
+                    f"for {stalled:.1f}s with {worker.outstanding} outstanding requests, killing"
+                )
+                # Killed workers go through the regular crash/restart path
+                worker.process.kill()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for worker in self.workers:
+            worker.stop()
+
+    async def _call(self, worker, kind, params, timeout, decode=None, max_in_flight=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        req_id = next(self._ids)
+
+        def deliver(status, payload):
+            loop.call_soon_threadsafe(_settle, future, decode, status, payload)
+
+        worker.submit(req_id, kind, params, deliver, max_in_flight=max_in_flight)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            worker.discard(req_id)
+
+    async def recommend(self, user_id, top_k=10, **filters) -> list[int]:
+        worker = self.workers[self.ring.get(user_id)]
+        params = {"user_id": user_id, "top_k": top_k, **filters}
+        return await self._call(
+            worker,
+            "recommend",
+            params,
+            self.timeout,
+            decode=_decode_items,
+            max_in_flight=self.max_in_flight
+        )
+
+    async def start_profile(self, interval: float, memory: bool):
+        params = {"interval": interval, "memory": memory}
+        await asyncio.gather(
+            *(self._call(worker, "profile_start", params, self.timeout) for worker in self.workers),
+            return_exceptions=True
+        )
+
+    async def stop_profile(self, top: int = 20) -> dict:
+        """
+        Collect `ProfileSession.export()` results keyed by worker label;
+        workers that crashed or restarted mid-run are left out.
+        """
+        results = await asyncio.gather(
+            *(
+                self._call(worker, "profile_stop", {"top": top}, self.timeout, decode=_decode_json)
+                for worker in self.workers
+            ),
+            return_exceptions=True
+        )
+        return {
+            f"worker-{worker.index}": result
+            for worker, result in zip(self.workers, results)
+            if not isinstance(result, BaseException)
+        }
+
+    def health(self) -> list[dict]:
+        """
+        Snapshot of supervisor state; never waits on a worker, so a deep
+        queue shows up as `outstanding`, not as unresponsive.
+        """
+        report = []
+        for worker in self.workers:
+            alive = worker.process.is_alive()
+            stalled = worker.stalled_for()
+            report.append({
+                "worker": worker.index,
+                "pid": worker.process.pid,
+                "alive": alive,
+                "ready": worker.ready,
+                "responsive": alive and worker.ready and stalled < self.stall_timeout,
+                "stalled_s": round(stalled, 2),
+                "outstanding": worker.outstanding,
+                "restarts": worker.restarts,
+                "gave_up": worker.gave_up,
+            })
+        return report
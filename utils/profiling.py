@@ -0,0 +1,238 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Leaf frames of threads parked in a blocking call (event loop select,
+# threadpool/queue waits, pipe reads); these are not CPU time.
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("connection.py", "_recv"),
+    ("connection.py", "_recv_bytes"),
+    ("connection.py", "recv_bytes"),
+    ("connection.py", "recv"),
+    ("connection.py", "_poll"),
+    ("connection.py", "wait"),
+    ("socket.py", "accept"),
+}
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """
+    In-process statistical profiler.
+
+    A background thread snapshots the stacks of all other threads every
+    `interval` seconds, so overhead is bounded by the sampling rate and
+    does not depend on how much code runs in the hot path. Threads parked
+    in a blocking call are counted as idle and left out of the stacks.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if _is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        Stacks in Brendan Gregg's collapsed format, ready for flamegraph.pl
+        or speedscope.
+        """
+        return "\n".join(
+            f"{';'.join(stack)} {count}"
+            for stack, count in self.stacks.most_common()
+        )
+
+    def top_functions(self, n: int = 20) -> list[dict]:
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            self_counts[stack[-1]] += count
+            for function in set(stack):
+                total_counts[function] += count
+
+        # Percentages are over busy samples only
+        total = sum(self.stacks.values()) or 1
+        return [
+            {
+                "function": function,
+                "total_samples": count,
+                "self_samples": self_counts[function],
+                "total_pct": round(100.0 * count / total, 2),
+                "self_pct": round(100.0 * self_counts[function] / total, 2),
+            }
+            for function, count in total_counts.most_common(n)
+        ]
+
+
+class AllocationTracker:
+    """
+    Diff of tracemalloc snapshots taken at start and stop, grouped by line.
+    """
+
+    def __init__(self, frames: int = 1):
+        self.frames = frames
+        self._started_here = False
+        self._start_snapshot = None
+        self._stop_snapshot = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_here = True
+        self._start_snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        self._stop_snapshot = tracemalloc.take_snapshot()
+        if self._started_here:
+            tracemalloc.stop()
+            self._started_here = False
+
+    def top_growth(self, n: int = 20) -> list[dict]:
+        stats = self._stop_snapshot.compare_to(self._start_snapshot, "lineno")
+        return [
+            {
+                "location": str(stat.traceback),
+                "size_diff_kb": round(stat.size_diff / 1024, 2),
+                "size_kb": round(stat.size / 1024, 2),
+                "count_diff": stat.count_diff,
+            }
+            for stat in stats[:n]
+        ]
+
+
+class ProfileSession:
+    """
+    One profiling run: stops after `duration` seconds or once
+    `max_requests` requests have been recorded, whichever comes first.
+    """
+
+    def __init__(self, duration: float, max_requests=None, interval: float = 0.005, memory: bool = False):
+        self.duration = duration
+        self.max_requests = max_requests
+        self.requests = 0
+        self.profiler = SamplingProfiler(interval=interval)
+        self.allocations = AllocationTracker() if memory else None
+        self.done = threading.Event()
+        self.started_at = None
+        self.elapsed = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        if self.allocations is not None:
+            self.allocations.start()
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+        if self.allocations is not None:
+            self.allocations.stop()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def record_request(self):
+        self.requests += 1
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            self.done.set()
+
+    def report(self, top: int = 20) -> dict:
+        report = {
+            "duration_s": round(self.elapsed, 3),
+            "requests": self.requests,
+            "samples": self.profiler.samples,
+            "busy_samples": sum(self.profiler.stacks.values()),
+            "idle_samples": self.profiler.idle_samples,
+            "top_functions": self.profiler.top_functions(top),
+            "collapsed": self.profiler.collapsed(),
+        }
+        if self.allocations is not None:
+            report["allocations"] = self.allocations.top_growth(top)
+        return report
+
+    def export(self, top: int = 20) -> dict:
+        """
+        Raw, JSON-serializable results for merging across processes.
+        """
+        return {
+            "duration_s": round(self.elapsed, 3),
+            "samples": self.profiler.samples,
+            "idle_samples": self.profiler.idle_samples,
+            "stacks": [[list(stack), count] for stack, count in self.profiler.stacks.items()],
+            "allocations": self.allocations.top_growth(top) if self.allocations is not None else None,
+        }
+
+
+def merge_reports(exports: dict, requests: int = 0, top: int = 20) -> dict:
+    """
+    Combine `ProfileSession.export()` results keyed by process label.
+    Collapsed stacks are rooted at the process label so flame graphs
+    keep processes apart; top functions are aggregated across all.
+    """
+    merged = SamplingProfiler()
+    labelled = SamplingProfiler()
+    allocations = []
+    for label, export in exports.items():
+        merged.samples += export["samples"]
+        merged.idle_samples += export["idle_samples"]
+        for stack, count in export["stacks"]:
+            merged.stacks[tuple(stack)] += count
+            labelled.stacks[(label, *stack)] += count
+        for stat in export["allocations"] or []:
+            allocations.append({"process": label, **stat})
+
+    report = {
+        "duration_s": max((e["duration_s"] for e in exports.values()), default=0.0),
+        "requests": requests,
+        "processes": list(exports),
+        "samples": merged.samples,
+        "busy_samples": sum(merged.stacks.values()),
+        "idle_samples": merged.idle_samples,
+        "top_functions": merged.top_functions(top),
+        "collapsed": labelled.collapsed(),
+    }
+    if any(e["allocations"] is not None for e in exports.values()):
+        report["allocations"] = sorted(allocations, key=lambda a: a["size_diff_kb"], reverse=True)[:top]
+    return report